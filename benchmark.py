@@ -0,0 +1,66 @@
+# benchmark.py
+# Times polygon queries against a quadtree of random points, with and
+# without clipping the polygon as the traversal descends.
+import json
+import math
+import random
+import time
+
+from shapely.geometry import Polygon
+from shapely.geometry import shape
+
+import quadtree as module
+
+class UnclippedFeature(object):
+    '''
+    Exposes only the three methods of a Feature that QuadTree needs, so
+    every node is tested against the whole polygon.
+    '''
+    def __init__(self, feature):
+        self.contains_point = feature.contains_point
+        self.contains_rectangle = feature.contains_rectangle
+        self.intersects_rectangle = feature.intersects_rectangle
+
+def random_points(bounds, n):
+    x0,z0,x1,z1 = bounds
+    return [(random.uniform(x0, x1), random.uniform(z0, z1)) for i in range(n)]
+
+def timeit(function, repeat=7):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+def benchmark(geometry, points):
+    tree = module.QuadTree(points)
+    clipped = module.Feature(geometry=geometry)
+    unclipped = UnclippedFeature(clipped)
+    count, clipped_time = timeit(lambda: tree.count_overlapping_points(clipped))
+    unclipped_count, unclipped_time = timeit(lambda: tree.count_overlapping_points(unclipped))
+    assert count == unclipped_count
+    return count, unclipped_time, clipped_time
+
+if __name__ == '__main__':
+    random.seed(0)
+    geojson = json.load(open("kings-county.geojson"))
+    geometry = shape(geojson['features'][0]['geometry'])
+    number_of_vertices = sum([len(polygon.exterior.coords) for polygon in geometry.geoms])
+    # a polygon with tens of thousands of vertices along a wiggly boundary
+    circle = [(math.cos(2*math.pi*i/50000)*(1 + 0.05*math.sin(2*math.pi*i/500)),
+               math.sin(2*math.pi*i/50000)*(1 + 0.05*math.sin(2*math.pi*i/500)))
+              for i in range(50000)]
+    geometries = [
+        ("kings-county.geojson", geometry, number_of_vertices),
+        ("wiggly circle", Polygon(circle), len(circle)),
+    ]
+    for name, geometry, number_of_vertices in geometries:
+        print("%s: %d vertices" % (name, number_of_vertices))
+        for n in (1000, 10000, 100000):
+            points = random_points(geometry.bounds, n)
+            count, unclipped_time, clipped_time = benchmark(geometry, points)
+            print("%7d points, %6d inside: unclipped %.3fs, clipped %.3fs (%.1fx)" % (
+                n, count, unclipped_time, clipped_time, unclipped_time/clipped_time))
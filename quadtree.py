@@ -7,6 +7,7 @@
 from shapely.geometry import Polygon as shapelyPolygon
 from shapely.geometry import Point as shapelyPoint
 from shapely.geometry.base import BaseGeometry
+from shapely.ops import clip_by_rect
 
 def featurize(point):
     try:
@@ -54,6 +55,25 @@ def point_in_rectangle(point, rectangle):
     x0,z0,x1,z1 = rectangle
     return x >= x0 and x <= x1 and z >= z0 and z <= z1
 
+def rectangles_intersect(rectangle, other):
+    x0,z0,x1,z1 = rectangle
+    ox0,oz0,ox1,oz1 = other
+    return x0 <= ox1 and ox0 <= x1 and z0 <= oz1 and oz0 <= z1
+
+def feature_bounds(feature):
+    # only features wrapping a geometry have a known bounding box
+    if hasattr(feature, 'geometry') and not feature.geometry.is_empty:
+        return feature.geometry.bounds
+    else:
+        return None
+
+def clip_to_rectangle(feature, rectangle):
+    # features that cannot be clipped are passed down unchanged
+    if hasattr(feature, 'clip'):
+        return feature.clip(rectangle)
+    else:
+        return feature
+
 class Feature(object):
     '''
     A wrapper around shapely geometries.
@@ -75,17 +95,47 @@ class Feature(object):
             return False
         x0,z0,x1,z1 = rectangle
         points = [(x0, z0), (x1, z0), (x1, z1), (x0, z1)]
+        bounds = self.geometry.bounds
+        if not all([point_in_rectangle(point, bounds) for point in points]):
+            return False
         shPolygon = shapelyPolygon(points)
-        return all([point_in_rectangle(point, self.geometry.bounds) for point in points]) and self.geometry.contains(shPolygon)
+        # the rectangle must not touch the boundary either, points on the
+        # boundary are not contained
+        return self.geometry.relate_pattern(shPolygon, 'T**FF*FF*')
 
     def intersects_rectangle(self, rectangle):
         if self.geometry.is_empty:
             return False
+        if not rectangles_intersect(rectangle, self.geometry.bounds):
+            return False
         x0,z0,x1,z1 = rectangle
         points = [(x0, z0), (x1, z0), (x1, z1), (x0, z1)]
         shPolygon = shapelyPolygon(points)
         return not self.geometry.disjoint(shPolygon)
 
+    def clip(self, rectangle):
+        '''
+        Return a feature of the same class that agrees with this one on
+        every point and rectangle within `rectangle`, but has fewer
+        vertices to test. Subclasses whose constructor does not take a
+        single geometry must override `clip`.
+        '''
+        # clipping an invalid geometry can change which points it contains
+        if self.geometry.is_empty or not self.geometry.is_valid:
+            return self
+        x0,z0,x1,z1 = rectangle
+        # pad the clipping box so that points on the edge of the rectangle
+        # do not end up on the boundary of the clipped geometry
+        margin = 0.01*max(x1 - x0, z1 - z0)
+        if margin <= 0:
+            return self
+        x0, z0, x1, z1 = x0 - margin, z0 - margin, x1 + margin, z1 + margin
+        # clipping is only worth it when it cuts away most of the geometry
+        bx0,bz0,bx1,bz1 = self.geometry.bounds
+        if (x1 - x0)*(z1 - z0) > 0.25*(bx1 - bx0)*(bz1 - bz0):
+            return self
+        return self.__class__(clip_by_rect(self.geometry, x0, z0, x1, z1))
+
 
 class Node(object):
     ROOT = 0
@@ -147,6 +197,9 @@ class Node(object):
                 # we cannot continue recursion, do a "manual" count
                 return sum([frequency for point, frequency in self._points.items() if feature.contains_point(point)])
             else:
+                if self.number_of_points > 0:
+                    # children only need the part of the feature within this node
+                    feature = clip_to_rectangle(feature, self.rectangle)
                 return sum([child.count_overlapping_points(feature) for child in self.children])
         else:
             return 0
@@ -160,6 +213,9 @@ class Node(object):
                 # we cannot continue recursion, do a "manual" count
                 return [point for point in self.features if feature.contains_point(point)]
             else:
+                if self.number_of_points > 0:
+                    # children only need the part of the feature within this node
+                    feature = clip_to_rectangle(feature, self.rectangle)
                 output = []
                 for child in self.children:
                     output.extend(child.get_overlapping_points(feature))
@@ -228,6 +284,96 @@ class Node(object):
                     yield point
 
   
+#===========================================================
+class QueryNode(object):
+    '''
+    A node in the index of standing queries. Queries that contain the
+    whole rectangle are listed in `queries`, queries that only overlap
+    it are kept in the leaves, clipped to the parent node. Leaves holding
+    more than `split_size` overlapping queries are split in 4, if that
+    separates them.
+    '''
+    MAX_DEPTH = 16
+
+    def __init__(self, rect, depth=0, max_queries=16):
+        self.children = []
+        self.queries = []
+        self.overlapping_queries = []
+        self.depth = depth
+        self.max_queries = max_queries
+        self.split_size = max_queries
+
+        self.rectangle = tuple([float(item) for item in rect])
+
+    def add_query(self, key, feature, bounds):
+        # bounds is the bounding box of the feature, or None if unknown
+        if bounds is not None and not rectangles_intersect(bounds, self.rectangle):
+            return
+        if feature.contains_rectangle(self.rectangle):
+            self.queries.append(key)
+        elif feature.intersects_rectangle(self.rectangle):
+            if self.children:
+                feature = clip_to_rectangle(feature, self.rectangle)
+                bounds = feature_bounds(feature)
+                for child in self.children:
+                    child.add_query(key, feature, bounds)
+            else:
+                self.overlapping_queries.append((key, feature, bounds))
+                if len(self.overlapping_queries) > self.split_size and self.depth < QueryNode.MAX_DEPTH:
+                    self.subdivide()
+
+    def subdivide(self):
+        x0,z0,x1,z1 = self.rectangle
+        half_width = (x1 - x0)/2
+        half_height = (z1 - z0)/2
+        rects = []
+        rects.append( (x0, z0, x0 + half_width, z0 + half_height) )
+        rects.append( (x0, z0 + half_height, x0 + half_width, z1) )
+        rects.append( (x0 + half_width, z0 + half_height, x1, z1) )
+        rects.append( (x0 + half_width, z0, x1, z0 + half_height) )
+        children = []
+        for rect in rects:
+            child = QueryNode(rect, self.depth + 1, self.max_queries)
+            # children cannot hold more queries than this node, so they are
+            # not split before we know whether this split helps
+            child.split_size = len(self.overlapping_queries)
+            children.append(child)
+        for key, feature, bounds in self.overlapping_queries:
+            feature = clip_to_rectangle(feature, self.rectangle)
+            bounds = feature_bounds(feature)
+            for child in children:
+                child.add_query(key, feature, bounds)
+
+        sizes = [len(child.overlapping_queries) for child in children]
+        if max(sizes) == len(self.overlapping_queries) and sum(sizes) >= 2*max(sizes):
+            # a child overlaps all queries and so does another, e.g. because
+            # they share a boundary: splitting does not separate them. Try
+            # again once twice as many queries overlap the leaf.
+            self.split_size = 2*len(self.overlapping_queries)
+            return
+        self.overlapping_queries = []
+        self.children = children
+        for child in self.children:
+            child.split_size = self.max_queries
+            if len(child.overlapping_queries) > child.split_size and child.depth < QueryNode.MAX_DEPTH:
+                child.subdivide()
+
+    def get_containing_queries(self, point):
+        ''' The keys of the queries that contain the point. '''
+        keys = list(self.queries)
+        if self.children:
+            # a point on an edge between children is only looked up in one
+            for child in self.children:
+                if point_in_rectangle(point, child.rectangle):
+                    keys.extend(child.get_containing_queries(point))
+                    break
+        else:
+            for key, feature, bounds in self.overlapping_queries:
+                if (bounds is None or point_in_rectangle(point, bounds)) and feature.contains_point(point):
+                    keys.append(key)
+        return keys
+
+
 #===========================================================            
 class QuadTree(Node):
     #_______________________________________________________
@@ -239,5 +385,23 @@ class QuadTree(Node):
         maxz = max([point[1] for point in pure_points])
         # if a split involves 16 checks of containment, the optimal number of points is 16/ln(4)
         super(QuadTree, self).__init__(None, rect=(minx,minz,maxx,maxz), max_points=11)
+        self.standing_counts = {}
+        self.standing_query_index = QueryNode(self.rectangle)
         for point in points:
             self.add_point(point)
+
+    def add_point(self, point):
+        point_feature = featurize(point)
+        super(QuadTree, self).add_point(point_feature)
+        for key in self.standing_query_index.get_containing_queries(feature_to_point(point_feature)):
+            self.standing_counts[key] += 1
+
+    def add_standing_query(self, key, feature):
+        '''
+        Register `feature` under `key`. Its count of overlapping points is
+        kept in `standing_counts[key]` and updated as points are added.
+        '''
+        if key in self.standing_counts:
+            raise Exception
+        self.standing_counts[key] = self.count_overlapping_points(feature)
+        self.standing_query_index.add_query(key, feature, feature_bounds(feature))
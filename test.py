@@ -76,6 +76,27 @@ class TestFeatureWrapper(ut.TestCase):
 		rectangle = (self.inside_point[0], self.inside_point[1], self.inside_point[0]+0.01, self.inside_point[1]+0.01)
 		self.failUnless(self.feature.contains_rectangle(rectangle))
 
+	def test_clipped_feature_is_smaller(self):
+		rectangle = (self.inside_point[0]-0.01, self.inside_point[1]-0.01, self.inside_point[0]+0.01, self.inside_point[1]+0.01)
+		clipped = self.feature.clip(rectangle)
+		self.failUnless(clipped.geometry.area < self.feature.geometry.area)
+
+	def test_clipped_feature_contains_same_points(self):
+		rectangle = tuple(self.inside_point+self.outside_point)
+		x0,z0,x1,z1 = rectangle
+		rectangle = (min(x0,x1), min(z0,z1), max(x0,x1), max(z0,z1))
+		clipped = self.feature.clip(rectangle)
+		self.failUnless(clipped.contains_point(self.inside_point))
+		self.failIf(clipped.contains_point(self.outside_point))
+
+	def test_count_with_clipping_same_as_without(self):
+		x0,z0,x1,z1 = self.feature.geometry.bounds
+		points = [(x0 + (x1-x0)*i/50.0, z0 + (z1-z0)*j/50.0) for i in range(51) for j in range(51)]
+		quadtree = module.QuadTree(points)
+		expected = len([point for point in points if self.feature.contains_point(point)])
+		self.assertEqual(quadtree.count_overlapping_points(self.feature), expected)
+		self.assertEqual(len(quadtree.get_overlapping_points(self.feature)), expected)
+
 class TestSquare(ut.TestCase):
 	def setUp(self):
 		self.square = module.Feature(Polygon([(0,0), (1,0), (1,1), (0,1)]))
@@ -98,6 +119,40 @@ class TestSquare(ut.TestCase):
 	def test_offset_square_intersects(self):
 		self.failUnless(self.square.intersects_rectangle((0.5, 0.5, 1.5, 1.5)))
 
+	def test_square_touching_edge_not_inside(self):
+		self.failIf(self.square.contains_rectangle((0, 0.25, 0.5, 0.75)))
+
+	def test_count_excludes_points_on_boundary(self):
+		points = [(x/16.0, y/16.0) for x in range(-8, 25) for y in range(-8, 25)]
+		quadtree = module.QuadTree(points)
+		expected = len([point for point in points if self.square.contains_point(point)])
+		self.assertEqual(quadtree.count_overlapping_points(self.square), expected)
+		self.assertEqual(len(quadtree.get_overlapping_points(self.square)), expected)
+
+	def test_invalid_polygon_is_not_clipped(self):
+		bowtie = module.Feature(Polygon([(0.1,0.1), (0.9,0.9), (0.9,0.1), (0.1,0.9)]))
+		self.assertIs(bowtie.clip((0.25, 0.25, 0.5, 0.5)), bowtie)
+
+	def test_count_with_invalid_polygon(self):
+		bowtie = module.Feature(Polygon([(0.1,0.1), (0.9,0.9), (0.9,0.1), (0.1,0.9)]))
+		points = [((x+0.5)/40.0, (y+0.5)/40.0) for x in range(40) for y in range(40)]
+		quadtree = module.QuadTree(points)
+		expected = len([point for point in points if bowtie.contains_point(point)])
+		self.assertEqual(quadtree.count_overlapping_points(bowtie), expected)
+		self.assertEqual(len(quadtree.get_overlapping_points(bowtie)), expected)
+
+	def test_clipped_square_keeps_class(self):
+		class SquareFeature(module.Feature):
+			pass
+		square = SquareFeature(self.square.geometry)
+		self.assertIsInstance(square.clip((0.5, 0.5, 0.75, 0.75)), SquareFeature)
+
+	def test_clipped_square_keeps_points_on_edge(self):
+		clipped = self.square.clip((0.5, 0.5, 0.75, 0.75))
+		self.failUnless(clipped.geometry.area < self.square.geometry.area)
+		self.failUnless(clipped.contains_point((0.5, 0.6)))
+		self.failUnless(clipped.contains_rectangle((0.5, 0.5, 0.75, 0.75)))
+
 
 class TestNode(ut.TestCase):
 	def test_empty_node(self):
@@ -447,5 +502,117 @@ class TestMetaData(ut.TestCase):
 		quadtree = module.QuadTree([feature1, feature2])
 		self.assertEqual(quadtree.rectangle, (0.25, 0.25, 0.75, 0.75))
 
+class TestStandingQueries(ut.TestCase):
+	def setUp(self):
+		self.quadtree = module.QuadTree([(0,0), (1,1), (0.25,0.25), (0.75,0.75)])
+		self.square = module.Feature(Polygon([(0.5,0.5), (1.5,0.5), (1.5,1.5), (0.5,1.5)]))
+		self.triangle = module.Feature(Polygon([(0.05,0.05), (0.6,0.05), (0.05,0.6)]))
+		self.quadtree.add_standing_query('square', self.square)
+		self.quadtree.add_standing_query('triangle', self.triangle)
+
+	def test_existing_points_are_counted(self):
+		self.assertEqual(self.quadtree.standing_counts['square'], 2)
+		self.assertEqual(self.quadtree.standing_counts['triangle'], 1)
+
+	def test_added_point_is_counted(self):
+		self.quadtree.add_point((0.9, 0.6))
+		self.assertEqual(self.quadtree.standing_counts['square'], 3)
+		self.assertEqual(self.quadtree.standing_counts['triangle'], 1)
+
+	def test_point_outside_queries_is_not_counted(self):
+		self.quadtree.add_point((0.1, 0.9))
+		self.assertEqual(self.quadtree.standing_counts['square'], 2)
+		self.assertEqual(self.quadtree.standing_counts['triangle'], 1)
+
+	def test_duplicate_key_raises_exception(self):
+		def callable():
+			self.quadtree.add_standing_query('square', self.triangle)
+		self.assertRaises(Exception, callable)
+
+	def test_points_on_query_edges(self):
+		quadtree = module.QuadTree([(0,0), (1,1)])
+		quadtree.add_standing_query('square', self.square)
+		for point in [(0.5,0.6), (0.5,0.9), (0.7,0.5), (0.5,0.5)]:
+			quadtree.add_point(point)
+		self.assertEqual(quadtree.standing_counts['square'], 1)
+
+	def test_standing_count_same_as_count(self):
+		# the grid includes points on the query edges and on the edges of
+		# the nodes of the tree and of the query index
+		points = [(x/16.0, y/16.0) for x in range(17) for y in range(17)]
+		points.extend([(0.3, 0.05), (0.05, 0.3), (0.3, 0.3)])
+		for point in points:
+			self.quadtree.add_point(point)
+			for key, feature in [('square', self.square), ('triangle', self.triangle)]:
+				self.assertEqual(self.quadtree.standing_counts[key], self.quadtree.count_overlapping_points(feature))
+		for key, feature in [('square', self.square), ('triangle', self.triangle)]:
+			expected = len([point for point in self.quadtree.walk() if feature.contains_point(point)])
+			self.assertEqual(self.quadtree.standing_counts[key], expected)
+
+def query_nodes(node):
+	yield node
+	for child in node.children:
+		for descendant in query_nodes(child):
+			yield descendant
+
+def query_leaves(node):
+	return [descendant for descendant in query_nodes(node) if not descendant.children]
+
+class TestClusteredStandingQueries(ut.TestCase):
+	def setUp(self):
+		self.quadtree = module.QuadTree([(0,0), (1,1)])
+		self.features = {}
+		for i in range(20):
+			for j in range(20):
+				x0, z0 = 0.5 + i*0.002, 0.5 + j*0.002
+				self.features[(i, j)] = module.Feature(Polygon([(x0,z0), (x0+0.003,z0), (x0+0.003,z0+0.003), (x0,z0+0.003)]))
+				self.quadtree.add_standing_query((i, j), self.features[(i, j)])
+
+	def test_clustered_queries_are_separated(self):
+		index = self.quadtree.standing_query_index
+		for leaf in query_leaves(index):
+			self.failUnless(len(leaf.overlapping_queries) <= index.max_queries)
+		self.failUnless(len(list(query_nodes(index))) < 2000)
+
+	def test_clustered_counts(self):
+		for x in range(41):
+			for y in range(41):
+				self.quadtree.add_point((0.5 + x*0.001, 0.5 + y*0.001))
+		for key, feature in self.features.items():
+			self.assertEqual(self.quadtree.standing_counts[key], self.quadtree.count_overlapping_points(feature))
+
+class TestSharedEdgeStandingQueries(ut.TestCase):
+	def setUp(self):
+		self.quadtree = module.QuadTree([(0,0), (1,1)])
+
+	def add_queries(self, polygons):
+		features = {}
+		for key, polygon in enumerate(polygons):
+			features[key] = module.Feature(polygon)
+			self.quadtree.add_standing_query(key, features[key])
+		return features
+
+	def test_shared_edges_are_not_split(self):
+		# the boxes share three edges
+		self.add_queries([Polygon([(0.1,0.1), (0.9,0.1), (0.9,0.3+0.01*i), (0.1,0.3+0.01*i)]) for i in range(20)])
+		self.failUnless(len(list(query_nodes(self.quadtree.standing_query_index))) < 100)
+
+	def test_duplicates_are_not_split(self):
+		self.add_queries([Polygon([(0.2,0.2), (0.6,0.2), (0.6,0.6), (0.2,0.6)]) for i in range(50)])
+		self.failUnless(len(list(query_nodes(self.quadtree.standing_query_index))) < 100)
+
+	def test_nested_queries_are_not_split(self):
+		# the boxes share a corner
+		self.add_queries([Polygon([(0.1,0.1), (0.1+0.004*i,0.1), (0.1+0.004*i,0.1+0.004*i), (0.1,0.1+0.004*i)]) for i in range(1, 100)])
+		self.failUnless(len(list(query_nodes(self.quadtree.standing_query_index))) < 1000)
+
+	def test_shared_edge_counts(self):
+		features = self.add_queries([Polygon([(0.1,0.1), (0.9,0.1), (0.9,0.3+0.01*i), (0.1,0.3+0.01*i)]) for i in range(20)])
+		for x in range(21):
+			for y in range(21):
+				self.quadtree.add_point((x/20.0, y/20.0))
+		for key, feature in features.items():
+			self.assertEqual(self.quadtree.standing_counts[key], self.quadtree.count_overlapping_points(feature))
+
 if __name__ == '__main__':
 	ut.main()
\ No newline at end of file